@@ -1,11 +1,15 @@
+from functools import lru_cache
+import numpy as np
 import pandas as pd
 from config.config_loader import load_toml
 import streamlit as st
 
 herd_varieties = load_toml("herd.toml")["herd_variety"]
+allowed_breeds = [s["cft_name"] for s in herd_varieties]
 
+@lru_cache(maxsize=None)
 def define_validation_rules():
-    """Define validation rules for each column"""
+    """Define validation rules for each column (built once; treat as read-only)"""
     return {
         "farm_id": {
             "type": "string",
@@ -28,7 +32,7 @@ def define_validation_rules():
         "main_breed_variety": {
             "type": "categorical",
             "required": True,
-            "allowed_values": [s["cft_name"] for s in herd_varieties]
+            "allowed_values": allowed_breeds
         },
         "bedding.type": {
             "type": "categorical",
@@ -41,18 +45,23 @@ def define_validation_rules():
 # -----------------------------
 # Validation Functions
 # -----------------------------
+def is_blank(value):
+    """True for None, NaN/NA and empty strings"""
+    return value is None or pd.isna(value) or value == ""
+
 def validate_value(value, column_name, rules):
     """Validate a single value against rules"""
     errors = []
+    blank = is_blank(value)
     
     # Check if required
     if rules.get("required", False):
-        if pd.isna(value) or value == "" or value is None:
+        if blank:
             errors.append(f"Required field is empty")
             return errors
     
     # If value is empty and not required, skip other checks
-    if pd.isna(value) or value == "" or value is None:
+    if blank:
         return errors
     
     # Type-specific validation
@@ -91,18 +100,74 @@ def validate_value(value, column_name, rules):
     
     return errors
 
+def flag_invalid_values(series, rules):
+    """
+    Vectorised pre-check of a column against its rules.
+    True marks cells validate_value may reject; every other cell passes.
+    """
+    blank = series.isna() | (series.astype(object) == "")
+    filled = ~blank
+    flagged = blank.copy() if rules.get("required", False) else pd.Series(False, index=series.index)
+
+    rule_type = rules.get("type")
+
+    if rule_type in ("numeric", "integer"):
+        num = pd.to_numeric(series, errors="coerce")
+        bad = num.isna()
+        if "min" in rules:
+            bad |= num < rules["min"]
+        if "max" in rules:
+            bad |= num > rules["max"]
+        if rule_type == "integer":
+            bad |= num % 1 != 0
+        flagged |= filled & bad
+
+    elif rule_type == "string":
+        lengths = series.astype(str).str.len()
+        bad = pd.Series(False, index=series.index)
+        if "min_length" in rules:
+            bad |= lengths < rules["min_length"]
+        if "max_length" in rules:
+            bad |= lengths > rules["max_length"]
+        flagged |= filled & bad
+
+    elif rule_type == "categorical":
+        flagged |= filled & ~series.isin(rules.get("allowed_values", []))
+
+    return flagged.to_numpy(dtype=bool)
+
 def validate_dataframe(df, validation_rules):
     """Validate entire dataframe and return error report"""
     error_report = []
-    
-    for _, row in df.iterrows():
+
+    rules_in_df = {
+        col_name: rules
+        for col_name, rules in validation_rules.items()
+        if col_name in df.columns
+    }
+    flags = {
+        col_name: flag_invalid_values(df[col_name], rules)
+        for col_name, rules in rules_in_df.items()
+    }
+    if not flags:
+        return error_report
+
+    # Only rows with a flagged cell need the per-value checks and messages
+    flagged_rows = np.flatnonzero(np.logical_or.reduce(list(flags.values())))
+    columns = list(df.columns)
+    col_positions = {col_name: columns.index(col_name) for col_name in rules_in_df}
+
+    for pos, values in zip(
+        flagged_rows,
+        df.iloc[flagged_rows].itertuples(index=False, name=None),
+    ):
         row_errors = {}
         
-        for col_name, rules in validation_rules.items():
-            if col_name not in df.columns:
+        for col_name, rules in rules_in_df.items():
+            if not flags[col_name][pos]:
                 continue
             
-            value = row[col_name]
+            value = values[col_positions[col_name]]
             errors = validate_value(value, col_name, rules)
             
             if errors:
@@ -113,9 +178,10 @@ def validate_dataframe(df, validation_rules):
                 }
         
         if row_errors:
+            row_data = df.iloc[pos].to_dict()
             error_report.append({
-                "survey_id": row.get("survey_id"),
-                "row_data": row.to_dict(),
+                "survey_id": row_data.get("survey_id"),
+                "row_data": row_data,
                 "errors": row_errors
             })
     
@@ -134,58 +200,58 @@ def check_duplicates_in_database(df, existing_df, id_column="farm_id"):
     if existing_df.empty or id_column not in existing_df.columns:
         return [], df
     
-    # Find duplicates
-    new_ids = set(df[id_column].dropna())
-    existing_ids = set(existing_df[id_column].dropna())
-    duplicate_ids = new_ids.intersection(existing_ids)
+    # Find duplicates (one vectorized membership pass)
+    existing_ids = existing_df[id_column].dropna().unique()
+    is_duplicate = df[id_column].isin(existing_ids)
     
-    if not duplicate_ids:
+    if not is_duplicate.any():
         return [], df
     
+    # First uploaded row per duplicate id, lined up with the first stored row
+    new_first = df[is_duplicate].drop_duplicates(subset=id_column)
+    existing_first = existing_df.drop_duplicates(subset=id_column).set_index(
+        id_column, drop=False
+    )
+    matched = existing_first.loc[new_first[id_column].tolist()]
+
+    # NaN-aware comparison of every shared column in one pass
+    common = [col for col in df.columns if col in existing_df.columns]
+    new_vals = new_first[common].to_numpy(dtype=object, copy=True)
+    existing_vals = matched[common].to_numpy(dtype=object, copy=True)
+    new_na = pd.isna(new_vals)
+    existing_na = pd.isna(existing_vals)
+    new_vals[new_na] = None
+    existing_vals[existing_na] = None
+    differs = (new_na != existing_na) | (new_vals != existing_vals)
+
     # Get rows with duplicate IDs and check for differences
     duplicate_rows = []
     rows_to_drop = []
     
-    for farm_id in duplicate_ids:
-        new_row_idx = df[df[id_column] == farm_id].index[0]
-        new_row_data = df.loc[new_row_idx].to_dict()
-        existing_row_data = existing_df[existing_df[id_column] == farm_id].iloc[0].to_dict()
-        
-        # Compare rows to find differences
-        differences = {}
-        for col in new_row_data.keys():
-            if col in existing_row_data:
-                new_val = new_row_data[col]
-                existing_val = existing_row_data[col]
-                
-                # Handle NaN comparison
-                new_is_na = pd.isna(new_val)
-                existing_is_na = pd.isna(existing_val)
-                
-                if new_is_na and existing_is_na:
-                    continue  # Both are NaN, consider them equal
-                elif new_is_na != existing_is_na:
-                    differences[col] = {
-                        "new": new_val,
-                        "existing": existing_val
-                    }
-                elif new_val != existing_val:
-                    differences[col] = {
-                        "new": new_val,
-                        "existing": existing_val
-                    }
-        
+    for i, (new_row_idx, farm_id) in enumerate(new_first[id_column].items()):
         # If no differences, automatically drop this row
-        if not differences:
+        if not differs[i].any():
             rows_to_drop.append(new_row_idx)
-        else:
-            duplicate_rows.append({
-                "farm_id": farm_id,
-                "row_index": new_row_idx,
-                "row_data": new_row_data,
-                "existing_data": existing_row_data,
-                "differences": differences
-            })
+            continue
+
+        new_row_data = df.loc[new_row_idx].to_dict()
+        existing_row_data = matched.iloc[i].to_dict()
+        differences = {
+            col: {
+                "new": new_row_data[col],
+                "existing": existing_row_data[col]
+            }
+            for col, differs_here in zip(common, differs[i])
+            if differs_here
+        }
+
+        duplicate_rows.append({
+            "farm_id": farm_id,
+            "row_index": new_row_idx,
+            "row_data": new_row_data,
+            "existing_data": existing_row_data,
+            "differences": differences
+        })
     
     # Drop exact matches silently
     cleaned_df = df.drop(rows_to_drop)
@@ -205,19 +271,40 @@ def display_duplicate_resolution_ui(duplicate_rows, df, existing_df):
     
     st.warning(f"⚠️ Found {len(duplicate_rows)} farm(s) with different data than what's in the database")
     
-    # Initialize session state
+    # Initialize session state (decisions only; the resolved frame is derived from them)
     if 'duplicate_decisions' not in st.session_state:
         st.session_state.duplicate_decisions = {}
-    if 'resolved_df' not in st.session_state:
-        st.session_state.resolved_df = df.copy()
+    
+    render_duplicate_decisions(duplicate_rows)
     
     # Track if all duplicates have been resolved
     all_resolved = len(st.session_state.duplicate_decisions) == len(duplicate_rows)
     
+    # Drop the rows the user chose to keep out, in one pass
+    dropped_indices = {
+        dup["row_index"]
+        for dup in duplicate_rows
+        if st.session_state.duplicate_decisions.get(dup["farm_id"]) == "drop"
+    }
+    return df.drop(index=list(dropped_indices)), all_resolved
+
+@st.fragment
+def render_duplicate_decisions(duplicate_rows):
+    """
+    Per-farm decision panels. Clicks rerun only this fragment while conflicts
+    remain; the page reruns when the set of resolved rows it depends on changes.
+    """
+    all_resolved = len(st.session_state.duplicate_decisions) == len(duplicate_rows)
+    
+    def rerun_after_decision():
+        now_resolved = len(st.session_state.duplicate_decisions) == len(duplicate_rows)
+        if all_resolved or now_resolved:
+            st.rerun()
+        st.rerun(scope="fragment")
+    
     # Display each duplicate
     for i, dup in enumerate(duplicate_rows):
         farm_id = dup["farm_id"]
-        row_idx = dup["row_index"]
         differences = dup["differences"]
         
         # Check if this duplicate has been resolved
@@ -256,7 +343,7 @@ def display_duplicate_resolution_ui(duplicate_rows, df, existing_df):
                         type="primary"
                     ):
                         st.session_state.duplicate_decisions[farm_id] = "overwrite"
-                        st.rerun()
+                        rerun_after_decision()
                 
                 with col2:
                     if st.button(
@@ -265,9 +352,7 @@ def display_duplicate_resolution_ui(duplicate_rows, df, existing_df):
                         use_container_width=True
                     ):
                         st.session_state.duplicate_decisions[farm_id] = "drop"
-                        # Remove this row from the dataframe
-                        st.session_state.resolved_df = st.session_state.resolved_df.drop(row_idx)
-                        st.rerun()
+                        rerun_after_decision()
             else:
                 st.divider()
                 # Show decision that was made
@@ -281,17 +366,9 @@ def display_duplicate_resolution_ui(duplicate_rows, df, existing_df):
                     key=f"change_{farm_id}",
                     use_container_width=True
                 ):
-                    # Reset decision for this farm
+                    # Reset decision for this farm (a dropped row comes back with it)
                     del st.session_state.duplicate_decisions[farm_id]
-                    # Restore row if it was dropped
-                    if decision == "drop":
-                        st.session_state.resolved_df = df.copy()
-                        # Reapply other drop decisions
-                        for fid, dec in st.session_state.duplicate_decisions.items():
-                            if dec == "drop":
-                                drop_idx = df[df["farm_id"] == fid].index[0]
-                                st.session_state.resolved_df = st.session_state.resolved_df.drop(drop_idx)
-                    st.rerun()
+                    rerun_after_decision()
     
     # Summary and proceed button
     if all_resolved:
@@ -302,6 +379,4 @@ def display_duplicate_resolution_ui(duplicate_rows, df, existing_df):
         st.success(f"✅ All conflicts resolved: {overwrite_count} to overwrite, {drop_count} to drop")
         
     else:
-        st.warning(f"⏳ Please resolve all {len(duplicate_rows)} conflict(s) before proceeding")
-    
-    return st.session_state.resolved_df, all_resolved
\ No newline at end of file
+        st.warning(f"⏳ Please resolve all {len(duplicate_rows)} conflict(s) before proceeding")
\ No newline at end of file
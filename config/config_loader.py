@@ -1,11 +1,14 @@
 import tomllib
+from functools import lru_cache
 from pathlib import Path
 
 CONFIG_DIR = Path(__file__).resolve().parent 
 
+@lru_cache(maxsize=16)
 def load_toml(name: str):
     """
     Loads a TOML config file from the config directory.
+    Parsed once per process; callers share the result and must not mutate it.
     """
     path = CONFIG_DIR / name
     if not path.exists():
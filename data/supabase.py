@@ -1,7 +1,8 @@
+import pyarrow as pa
 import streamlit as st
-from supabase import create_client
+from supabase import create_client, ClientOptions
 from datetime import datetime, timezone
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Callable
 
 # ------------------------------------------------------------------
 # Client
@@ -10,7 +11,24 @@ from typing import List, Dict, Optional, Any
 SUPABASE_URL = st.secrets["supabase-public"]["url"]
 SUPABASE_KEY = st.secrets["supabase-public"]["key"]
 
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Seconds before a PostgREST request gives up
+REQUEST_TIMEOUT = 30
+
+
+@st.cache_resource
+def get_supabase_client():
+    """
+    One Supabase client per server process, shared by every session and
+    rerun so its HTTP connection pool is reused.
+    """
+    return create_client(
+        SUPABASE_URL,
+        SUPABASE_KEY,
+        options=ClientOptions(postgrest_client_timeout=REQUEST_TIMEOUT),
+    )
+
+
+supabase = get_supabase_client()
 
 
 # ------------------------------------------------------------------
@@ -21,6 +39,12 @@ TABLE_INPUTS = "dairy_farm_inputs"
 TABLE_OUTPUTS = "dairy_farm_outputs"
 TABLE_SUMMARY = "dairy_imact_summary"
 
+# Rows per HTTP request for bulk writes
+UPSERT_CHUNK_SIZE = 500
+
+# Rows per page for reads (PostgREST caps each response at max-rows)
+PAGE_SIZE = 1000
+
 # ------------------------------------------------------------------
 # Helpers
 # ------------------------------------------------------------------
@@ -29,14 +53,55 @@ def _now() -> str:
     return datetime.now(timezone.utc).isoformat()
 
 
+def _select_columns(columns: Optional[List[str]]) -> List[str]:
+    """
+    Quote column names for a PostgREST select (names contain dots).
+    """
+    if not columns:
+        return ["*"]
+    return [f'"{c}"' for c in columns]
+
+
+def _select_all(build_query: Callable, page_size: int = PAGE_SIZE) -> List[Dict]:
+    """
+    Fetch every row of a select query, one page per request.
+
+    build_query must return a fresh, ordered query builder on each call.
+    """
+    rows = []
+    start = 0
+
+    while True:
+        res = build_query().range(start, start + page_size - 1).execute()
+        rows.extend(res.data)
+
+        if len(res.data) < page_size:
+            return rows
+
+        start += page_size
+
+
+def _records(df) -> List[Dict]:
+    """
+    DataFrame rows as JSON-ready dicts, converted column-wise by Arrow.
+    Missing values (NaN/NA) come out as None, i.e. SQL NULL.
+    """
+    return pa.Table.from_pandas(df, preserve_index=False).to_pylist()
+
+
+def _chunks(rows: List[Dict], size: int):
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+
 def _replace_rows(table: str, id_column: str, id_value: Any, rows: List[Dict]):
     """
     Hard replace all rows for a given identifier.
     """
     supabase.table(table).delete().eq(id_column, id_value).execute()
 
-    if rows:
-        supabase.table(table).insert(rows).execute()
+    for chunk in _chunks(rows, UPSERT_CHUNK_SIZE):
+        supabase.table(table).insert(chunk, returning="minimal").execute()
 
 
 # ------------------------------------------------------------------
@@ -46,17 +111,26 @@ def _replace_rows(table: str, id_column: str, id_value: Any, rows: List[Dict]):
 def get_dairy_inputs(
     survey_id: Optional[str] = None,
     limit: Optional[int] = None,
+    columns: Optional[List[str]] = None,
 ):
-    query = supabase.table(TABLE_INPUTS).select("*")
+    """
+    Fetch dairy input rows, optionally projected to the given columns.
+    Without a limit, all rows are fetched page by page.
+    """
 
-    if survey_id is not None:
-        query = query.eq("survey_id", survey_id)
+    def build_query():
+        query = supabase.table(TABLE_INPUTS).select(*_select_columns(columns))
+
+        if survey_id is not None:
+            query = query.eq("survey_id", survey_id)
+
+        return query
 
     if limit is not None:
-        query = query.limit(limit)
+        res = build_query().limit(limit).execute()
+        return res.data
 
-    res = query.execute()
-    return res.data
+    return _select_all(lambda: build_query().order("survey_id"))
 
 
 def insert_dairy_input(row: Dict):
@@ -98,20 +172,29 @@ def upsert_dairy_inputs(rows: List[Dict]):
       - survey_id is a unique or primary key
     """
 
+    upsert_dairy_inputs_bulk(rows)
+
+
+def upsert_dairy_inputs_bulk(rows: List[Dict], chunk_size: int = UPSERT_CHUNK_SIZE):
+    """
+    Upsert dairy input rows in chunks, one request per chunk.
+
+    Each request merges duplicates on survey_id and asks PostgREST
+    not to echo the rows back (return=minimal).
+    """
+
     if not rows:
         return
 
-    payload = []
-    for r in rows:
-        payload.append({
-            **r,
-            "last_updated": _now(),
-        })
+    now = _now()
+    payload = [{**r, "last_updated": now} for r in rows]
 
-    supabase.table(TABLE_INPUTS).upsert(
-        payload,
-        on_conflict="survey_id",
-    ).execute()
+    for chunk in _chunks(payload, chunk_size):
+        supabase.table(TABLE_INPUTS).upsert(
+            chunk,
+            on_conflict="survey_id",
+            returning="minimal",
+        ).execute()
 
 
 # ------------------------------------------------------------------
@@ -122,8 +205,9 @@ def get_dairy_outputs(
     farm_id: Optional[str] = None,
     survey_id: Optional[str] = None,
     limit: Optional[int] = None,
+    columns: Optional[List[str]] = None,
 ):
-    query = supabase.table(TABLE_OUTPUTS).select("*")
+    query = supabase.table(TABLE_OUTPUTS).select(*_select_columns(columns))
 
     if farm_id is not None:
         query = query.eq("farm_id", farm_id)
@@ -149,13 +233,8 @@ def replace_dairy_outputs(
     if not rows:
         return
 
-    payload = []
-    for r in rows:
-        payload.append({
-            **r,
-            "survey_id": survey_id,
-            "last_updated": _now(),
-        })
+    now = _now()
+    payload = [{**r, "survey_id": survey_id, "last_updated": now} for r in rows]
 
     # delete everything for this survey
     supabase.table(TABLE_OUTPUTS) \
@@ -164,7 +243,8 @@ def replace_dairy_outputs(
         .execute()
 
     # insert fresh state
-    supabase.table(TABLE_OUTPUTS).insert(payload).execute()
+    for chunk in _chunks(payload, UPSERT_CHUNK_SIZE):
+        supabase.table(TABLE_OUTPUTS).insert(chunk, returning="minimal").execute()
 
 
 def upsert_dairy_outputs(rows: List[Dict]):
@@ -178,17 +258,15 @@ def upsert_dairy_outputs(rows: List[Dict]):
     if not rows:
         return
 
-    payload = []
-    for r in rows:
-        payload.append({
-            **r,
-            "last_updated": _now(),
-        })
+    now = _now()
+    payload = [{**r, "last_updated": now} for r in rows]
 
-    supabase.table(TABLE_OUTPUTS).upsert(
-        payload,
-        on_conflict="survey_id",
-    ).execute()
+    for chunk in _chunks(payload, UPSERT_CHUNK_SIZE):
+        supabase.table(TABLE_OUTPUTS).upsert(
+            chunk,
+            on_conflict="survey_id",
+            returning="minimal",
+        ).execute()
 
 
 def delete_dairy_outputs_by_farm_id(farm_id: str):
@@ -204,7 +282,7 @@ def upsert_inputs_from_df(df):
     """
     Convert a DataFrame to records and upsert into dairy_farm_inputs.
     """
-    records = df.to_dict(orient="records")
+    records = _records(df)
     upsert_dairy_inputs(records)
 
 
@@ -212,7 +290,7 @@ def upsert_outputs_from_df(df):
     """
     Convert a DataFrame to records and upsert into dairy_farm_outputs.
     """
-    records = df.to_dict(orient="records")
+    records = _records(df)
     upsert_dairy_outputs(records)
 
 
@@ -220,9 +298,15 @@ def upsert_outputs_from_df(df):
 # Final View
 # ------------------------------------------------------------------
 
-def get_impact_summary(farm_id: Optional[str] = None):
-    
-    query = supabase.table(TABLE_SUMMARY).select("*")
+def get_impact_summary(
+    farm_id: Optional[str] = None,
+    columns: Optional[List[str]] = None,
+):
+    """
+    Fetch impact summary rows, optionally projected to the given columns.
+    """
+
+    query = supabase.table(TABLE_SUMMARY).select(*_select_columns(columns))
 
     if farm_id is not None:
         query = query.eq("farm_id", farm_id)
@@ -1,20 +1,26 @@
+import io
 import streamlit as st
 import pandas as pd
 import plotly.express as px
 from data.supabase import get_impact_summary 
-from typing import Optional
-
-from farm_impact import load_results
 
 # --- Page Config ---
 st.set_page_config(layout="wide", page_title="Farm Comparison")
 
 # --- Data Loading & Transformation ---
 
+@st.cache_data(ttl=60, show_spinner=False)
 def load_all_results() -> pd.DataFrame:
     """Load all impact summary results."""
     return pd.DataFrame(get_impact_summary())
 
+@st.cache_data(show_spinner=False)
+def to_csv_bytes(df: pd.DataFrame) -> bytes:
+    """Serialise a results table for download."""
+    buffer = io.BytesIO()
+    df.to_csv(buffer, index=False, encoding="utf-8")
+    return buffer.getvalue()
+
 
 # Shared source labels for absolute (_total_CO2e) columns
 SOURCE_LABEL_MAP_ABSOLUTE = {
@@ -26,16 +32,22 @@ SOURCE_LABEL_MAP_ABSOLUTE = {
     "fertiliser_total_CO2e": "Fertiliser",
     "transport_total_CO2e": "Transport",
 }
+SOURCE_DTYPE = pd.CategoricalDtype(list(SOURCE_LABEL_MAP_ABSOLUTE.values()))
 
 def get_latest_year_summary(df: pd.DataFrame) -> pd.DataFrame:
     """Filter the summary to include only the latest year for each farm."""
     if df.empty:
         return pd.DataFrame()
-    latest_years = df.loc[df.groupby("farm_id")["milk_year"].idxmax()]
+    latest_years = df.sort_values(
+        ["farm_id", "milk_year"], ascending=[True, False], kind="stable"
+    ).drop_duplicates("farm_id")
     return latest_years
 
 def prepare_comparison_data(df: pd.DataFrame) -> pd.DataFrame:
-    """Prepare data for the comparison bar chart and table."""
+    """
+    Prepare data for the comparison bar chart and table.
+    farm_id comes back as a categorical ordered by total emissions, highest first.
+    """
     value_vars = [c for c in SOURCE_LABEL_MAP_ABSOLUTE if c in df.columns]
     melted = df.melt(
         id_vars=["farm_id", "milk_year", "emissions_total"],
@@ -43,7 +55,9 @@ def prepare_comparison_data(df: pd.DataFrame) -> pd.DataFrame:
         value_name="tco2e",
         var_name="emission_source",
     )
-    melted["emission_source"] = melted["emission_source"].map(SOURCE_LABEL_MAP_ABSOLUTE)
+    melted["emission_source"] = melted["emission_source"].map(SOURCE_LABEL_MAP_ABSOLUTE).astype(SOURCE_DTYPE)
+    farm_order = df.sort_values("emissions_total", ascending=False)["farm_id"].tolist()
+    melted["farm_id"] = pd.Categorical(melted["farm_id"], categories=farm_order, ordered=True)
     return melted.sort_values("emissions_total", ascending=False)
 
 # --- Main UI ---
@@ -51,10 +65,12 @@ def prepare_comparison_data(df: pd.DataFrame) -> pd.DataFrame:
 st.title("Farm-to-Farm Comparison")
 st.caption("Compare emission performance across all farms for the most recent reporting year.")
 
+all_summary = load_all_results()
+
 # --- Download Button ---
 st.sidebar.download_button(
     label="Download All Impact Data (CSV)",
-    data=load_all_results().to_csv(index=False),
+    data=to_csv_bytes(all_summary),
     file_name=f"all_farm_impact_data.csv",
     mime="text/csv",
     help=(
@@ -63,8 +79,6 @@ st.sidebar.download_button(
     ),
 )
 
-all_summary = load_all_results()
-
 if all_summary.empty:
     st.warning("No impact summary data available for comparison.")
     st.stop()
@@ -83,7 +97,10 @@ fig = px.bar(
     color="emission_source",
     title="Total Emissions by Farm (Latest Year)",
     labels={"farm_id": "Farm", "tco2e": "Total Emissions (tCO₂e)", "emission_source": "Source"},
-    category_orders={"farm_id": comparison_data.drop_duplicates("farm_id")["farm_id"].tolist()}
+    category_orders={
+        "farm_id": list(comparison_data["farm_id"].cat.categories),
+        "emission_source": list(SOURCE_DTYPE.categories),
+    }
 )
 fig.update_layout(barmode="stack", xaxis_title=None, xaxis_tickangle=45)
 
@@ -1,3 +1,4 @@
+import io
 import streamlit as st
 from data.supabase import (
     get_dairy_inputs,
@@ -5,6 +6,7 @@ from data.supabase import (
     delete_dairy_inputs_by_farm_id,
     delete_dairy_outputs_by_farm_id,
 )
+import numpy as np
 import pandas as pd
 import plotly.express as px
 from typing import Optional
@@ -36,15 +38,23 @@ st.caption(
 
 # --- Data Loading ---
 
-
+@st.cache_data(ttl=60, show_spinner=False)
 def load_farms() -> pd.DataFrame:
     """Load all farm input data."""
     return pd.DataFrame(get_dairy_inputs())
 
+@st.cache_data(ttl=60, show_spinner=False)
 def load_results(farm_id: Optional[str] = None) -> pd.DataFrame:
     """Load impact summary results for a given farm."""
     return pd.DataFrame(get_impact_summary(farm_id))
 
+@st.cache_data(ttl=60, show_spinner=False)
+def get_all_impact_summary_csv() -> bytes:
+    """Serialise the impact summary for all farms for download."""
+    buffer = io.BytesIO()
+    load_results().to_csv(buffer, index=False, encoding="utf-8")
+    return buffer.getvalue()
+
 def get_selected_farm_id(farms: pd.DataFrame, pre_selected_index: int = 0) -> Optional[str]:
     """Get the selected farm_id from the sidebar."""
     if farms.empty:
@@ -77,7 +87,9 @@ SOURCE_LABEL_MAP_ABSOLUTE = {
     "fertiliser_total_CO2e": "Fertiliser",
     "transport_total_CO2e": "Transport",
 }
+SOURCE_DTYPE = pd.CategoricalDtype(list(SOURCE_LABEL_MAP_ABSOLUTE.values()))
 
+@st.cache_data(show_spinner=False)
 def melt_and_label_summary(summary: pd.DataFrame) -> pd.DataFrame:
     """Melt the summary DataFrame for easier plotting and apply readable labels (intensity, per FPCM)."""
     value_vars = [c for c in SOURCE_LABEL_MAP_INTENSITY if c in summary.columns]
@@ -87,9 +99,10 @@ def melt_and_label_summary(summary: pd.DataFrame) -> pd.DataFrame:
         value_name="intensity_tco2e_per_fpcm",
         var_name="emission_source",
     )
-    melted["emission_source"] = melted["emission_source"].map(SOURCE_LABEL_MAP_INTENSITY)
+    melted["emission_source"] = melted["emission_source"].map(SOURCE_LABEL_MAP_INTENSITY).astype(SOURCE_DTYPE)
     return melted
 
+@st.cache_data(show_spinner=False)
 def melt_summary_absolute(summary: pd.DataFrame) -> pd.DataFrame:
     """Melt the summary DataFrame to absolute emissions by source (tonnes CO₂e)."""
     value_vars = [c for c in SOURCE_LABEL_MAP_ABSOLUTE if c in summary.columns]
@@ -99,20 +112,11 @@ def melt_summary_absolute(summary: pd.DataFrame) -> pd.DataFrame:
         value_name="tco2e",
         var_name="emission_source",
     )
-    melted["emission_source"] = melted["emission_source"].map(SOURCE_LABEL_MAP_ABSOLUTE)
+    melted["emission_source"] = melted["emission_source"].map(SOURCE_LABEL_MAP_ABSOLUTE).astype(SOURCE_DTYPE)
     return melted
 
-def get_pie_data_absolute(summary: pd.DataFrame):
-    """Return a DataFrame of emission_source and tco2e for the latest year (for pie: % of total farm emissions)."""
-    if summary.empty or "milk_year" not in summary.columns:
-        return pd.DataFrame(columns=["emission_source", "tco2e"])
-    latest_year = summary["milk_year"].max()
-    row = summary[summary["milk_year"] == latest_year].iloc[0]
-    records = []
-    for col, label in SOURCE_LABEL_MAP_ABSOLUTE.items():
-        if col in row.index and pd.notna(row[col]) and float(row[col]) != 0:
-            records.append({"emission_source": label, "tco2e": float(row[col])})
-    return pd.DataFrame(records)
+HERD_COUNT_COLS = [f"{herd['cft_name']}.herd_count" for herd in HERD_SECTIONS]
+HERD_LABELS = [herd["display_name"] for herd in HERD_SECTIONS]
 
 # Source keys for table (column prefixes in schema)
 SOURCE_GAS_COLS = [
@@ -125,34 +129,24 @@ SOURCE_GAS_COLS = [
     ("transport", "Transport"),
 ]
 
+GAS_TABLE_COLUMNS = ["CO₂ (tonnes)", "N₂O (tonnes)", "CH₄ (tonnes)", "Total CO₂e (tonnes)"]
+# Summary fields in table order: one row per source (CO2, N2O, CH4, total CO2e), then the farm totals
+SOURCE_GAS_FIELDS = [
+    f"{prefix}_{gas}"
+    for prefix, _ in SOURCE_GAS_COLS
+    for gas in ("CO2", "N2O", "CH4", "total_CO2e")
+] + ["CO2_tonnes", "N2O_tonnes", "CH4_tonnes", "emissions_total"]
+SOURCE_GAS_LABELS = [label for _, label in SOURCE_GAS_COLS] + ["Total"]
+
 def build_source_by_gas_table(summary_row: pd.Series) -> pd.DataFrame:
     """Build a table of emissions by source and gas type (CO2, N2O, CH4, Total CO2e) from one year's summary row."""
-    rows = []
-    for prefix, label in SOURCE_GAS_COLS:
-        co2 = summary_row.get(f"{prefix}_CO2")
-        n2o = summary_row.get(f"{prefix}_N2O")
-        ch4 = summary_row.get(f"{prefix}_CH4")
-        total_co2e = summary_row.get(f"{prefix}_total_CO2e")
-        rows.append({
-            "Source": label,
-            "CO₂ (tonnes)": float(co2) if pd.notna(co2) else None,
-            "N₂O (tonnes)": float(n2o) if pd.notna(n2o) else None,
-            "CH₄ (tonnes)": float(ch4) if pd.notna(ch4) else None,
-            "Total CO₂e (tonnes)": float(total_co2e) if pd.notna(total_co2e) else None,
-        })
-    # Total row
-    co2_t = summary_row.get("CO2_tonnes")
-    n2o_t = summary_row.get("N2O_tonnes")
-    ch4_t = summary_row.get("CH4_tonnes")
-    tot_t = summary_row.get("emissions_total")
-    rows.append({
-        "Source": "Total",
-        "CO₂ (tonnes)": float(co2_t) if pd.notna(co2_t) else None,
-        "N₂O (tonnes)": float(n2o_t) if pd.notna(n2o_t) else None,
-        "CH₄ (tonnes)": float(ch4_t) if pd.notna(ch4_t) else None,
-        "Total CO₂e (tonnes)": float(tot_t) if pd.notna(tot_t) else None,
-    })
-    df = pd.DataFrame(rows)
+    values = (
+        summary_row.reindex(SOURCE_GAS_FIELDS)
+        .to_numpy(dtype=float, na_value=np.nan)
+        .reshape(len(SOURCE_GAS_LABELS), len(GAS_TABLE_COLUMNS))
+    )
+    df = pd.DataFrame(values, columns=GAS_TABLE_COLUMNS)
+    df.insert(0, "Source", SOURCE_GAS_LABELS)
     return df
 
 # --- Plotting Functions ---
@@ -174,8 +168,8 @@ def build_emissions_figure(
     else:
         # Emission Source Share: % of total farm emissions (from absolute)
         plot_df = summary_absolute_melted.copy()
-        total_per_year = plot_df.groupby("milk_year")["tco2e"].transform("sum")
-        plot_df["y"] = plot_df["tco2e"] / total_per_year.replace(0, pd.NA)
+        yearly_totals = plot_df.groupby("milk_year", sort=False)["tco2e"].sum().replace(0, np.nan)
+        plot_df["y"] = plot_df["tco2e"] / plot_df["milk_year"].map(yearly_totals)
         y_label, tick_format, title = "Share of total emissions", ".0%", "Emission source share over years"
 
     fig = px.bar(
@@ -185,18 +179,20 @@ def build_emissions_figure(
         color="emission_source",
         title=title,
         labels={"milk_year": "Milk Year", "y": y_label, "emission_source": "Source"},
+        category_orders={"emission_source": list(SOURCE_DTYPE.categories)},
     )
     fig.update_layout(barmode="stack", legend_title="Source")
     if tick_format:
         fig.update_yaxes(tickformat=tick_format)
     return fig
 
-def build_emissions_pie_chart(summary: pd.DataFrame):
+def build_emissions_pie_chart(summary_absolute_melted: pd.DataFrame):
     """Builds a pie chart showing share of total farm emissions by source (latest year)."""
-    pie_data = get_pie_data_absolute(summary)
+    latest_year = summary_absolute_melted["milk_year"].max()
+    latest = summary_absolute_melted[summary_absolute_melted["milk_year"] == latest_year]
+    pie_data = latest.loc[latest["tco2e"].fillna(0) != 0, ["emission_source", "tco2e"]]
     if pie_data.empty:
         return px.pie(names=[], values=[]).update_layout(title="Share of total farm emissions (no data)")
-    latest_year = summary["milk_year"].max()
     fig = px.pie(
         pie_data,
         names="emission_source",
@@ -210,10 +206,10 @@ def build_emissions_pie_chart(summary: pd.DataFrame):
 
 def build_cow_breakdown_figure(farm_inputs: pd.DataFrame):
     """Builds a bar chart for cow breakdown by herd section."""
-    cow_columns = [f"{herd['cft_name']}.herd_count" for herd in HERD_SECTIONS]
-    cow_breakdown = farm_inputs[cow_columns].T
-    cow_breakdown.columns = ["cow_count"]
-    cow_breakdown["herd_section"] = [s['display_name'] for s in HERD_SECTIONS]
+    cow_breakdown = pd.DataFrame({
+        "herd_section": HERD_LABELS,
+        "cow_count": farm_inputs[HERD_COUNT_COLS].to_numpy()[0],
+    })
     
     fig = px.bar(
         cow_breakdown,
@@ -229,7 +225,7 @@ def build_cow_breakdown_figure(farm_inputs: pd.DataFrame):
 # --- Download Button ---
 st.sidebar.download_button(
     label="Download All Impact Data (CSV)",
-    data=load_results().to_csv(index=False),
+    data=get_all_impact_summary_csv(),
     file_name=f"all_farm_impact_data.csv",
     mime="text/csv",
     help=(
@@ -238,24 +234,20 @@ st.sidebar.download_button(
     ),
 )
 
-
-def get_all_impact_summary_csv() -> str:
-    """Fetches all impact summary data and returns it as a CSV string."""
-    all_summary_df = pd.DataFrame(get_impact_summary())
-    return all_summary_df.to_csv(index=False)
-
 def display_kpi_metrics(summary: pd.DataFrame, farm_inputs: pd.DataFrame):
     """Display key performance indicators in metric cards."""
     latest_year = summary["milk_year"].max()
-    latest_summary = summary[summary["milk_year"] == latest_year]
-
-    if latest_summary.empty:
+    if pd.isna(latest_year):
         st.warning("No data for the latest year to display KPIs.")
         return
 
-    total_emissions = latest_summary["emissions_total"].iloc[0] if "emissions_total" in latest_summary.columns else None
-    total_emissions_intensity = latest_summary["emissions_per_fpcm"].iloc[0] if pd.notna(latest_summary["emissions_per_fpcm"].iloc[0]) else None
-    total_cows = farm_inputs[[f"{herd['cft_name']}.herd_count" for herd in HERD_SECTIONS]].sum(axis=1).iloc[0]
+    # First row per milk year, as plain dicts for the scalar lookups below
+    by_year = summary.drop_duplicates(subset="milk_year").set_index("milk_year", drop=False)
+    latest = by_year.loc[latest_year].to_dict()
+
+    total_emissions = latest.get("emissions_total")
+    total_emissions_intensity = latest.get("emissions_per_fpcm") if pd.notna(latest.get("emissions_per_fpcm")) else None
+    total_cows = farm_inputs[HERD_COUNT_COLS].iloc[0].sum()
     milk_production = farm_inputs["total_milk_production_litres"].iloc[0]
 
     # Deltas vs previous year
@@ -263,11 +255,11 @@ def display_kpi_metrics(summary: pd.DataFrame, farm_inputs: pd.DataFrame):
     delta_intensity = None
     if len(summary) > 1:
         previous_year = summary["milk_year"].nlargest(2).iloc[-1]
-        previous_summary = summary[summary["milk_year"] == previous_year]
-        if "emissions_total" in previous_summary.columns and pd.notna(previous_summary["emissions_total"].iloc[0]):
-            delta_total = (total_emissions or 0) - float(previous_summary["emissions_total"].iloc[0])
-        if pd.notna(previous_summary["emissions_per_fpcm"].iloc[0]):
-            delta_intensity = (total_emissions_intensity or 0) - float(previous_summary["emissions_per_fpcm"].iloc[0])
+        previous = by_year.loc[previous_year].to_dict()
+        if pd.notna(previous.get("emissions_total")):
+            delta_total = (total_emissions or 0) - float(previous["emissions_total"])
+        if pd.notna(previous.get("emissions_per_fpcm")):
+            delta_intensity = (total_emissions_intensity or 0) - float(previous["emissions_per_fpcm"])
 
     kpi_row = st.container(horizontal=True, horizontal_alignment="distribute", gap="medium")
     with kpi_row:
@@ -330,6 +322,9 @@ if selected_farm_id:
                     try:
                         delete_dairy_inputs_by_farm_id(selected_farm_id)
                         delete_dairy_outputs_by_farm_id(selected_farm_id)
+                        load_farms.clear()
+                        load_results.clear()
+                        get_all_impact_summary_csv.clear()
                         st.success(f"✓ Farm '{selected_farm_id}' deleted successfully.")
                         st.session_state.delete_confirmation = False
                         st.session_state.farm_deleted = True
@@ -394,7 +389,7 @@ with tab1:
         fig_emissions = build_emissions_figure(summary_melted, summary_absolute_melted, mode)
         st.plotly_chart(fig_emissions, use_container_width=True, theme="streamlit")
     with chart_col2:
-        fig_pie = build_emissions_pie_chart(summary)
+        fig_pie = build_emissions_pie_chart(summary_absolute_melted)
         st.plotly_chart(fig_pie, use_container_width=True, theme="streamlit")
 
     st.subheader("Emissions by source and gas")
@@ -419,7 +414,7 @@ with tab1:
         source_gas_df = build_source_by_gas_table(summary_row)
         st.dataframe(
             source_gas_df.style.format(
-                subset=["CO₂ (tonnes)", "N₂O (tonnes)", "CH₄ (tonnes)", "Total CO₂e (tonnes)"],
+                subset=GAS_TABLE_COLUMNS,
                 formatter="{:.2f}",
                 na_rep="—",
             ),
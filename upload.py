@@ -1,14 +1,18 @@
 import streamlit as st
 import pandas as pd
 import os
+import hashlib
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 from openpyxl import load_workbook
+from openpyxl.utils.cell import coordinate_to_tuple
 from config.config_loader import load_toml
 from components.data_cleaning import *
 import streamlit_notify as stn
 from utils.api_parser import submit_new_surveys
 from data.supabase import (
     get_dairy_inputs,
-    upsert_dairy_inputs,
+    upsert_dairy_inputs_bulk,
     upsert_outputs_from_df,
 )
 import unicodedata
@@ -37,11 +41,46 @@ st.info(
 
 stn.notify()
 
-data = get_dairy_inputs()
-df = pd.DataFrame(data)
 
-herd_sections = load_toml("herd.toml")["herd_section"]
-herd_varieties = load_toml("herd.toml")["herd_variety"]
+# ---- Cached loaders (survive reruns)
+@st.cache_data(ttl=60, show_spinner=False)
+def load_existing_inputs(columns: list) -> pd.DataFrame:
+    """Load dairy inputs already in the database, limited to the given columns."""
+    records = get_dairy_inputs(columns=columns)
+    return pd.DataFrame.from_records(records, columns=columns).convert_dtypes(
+        dtype_backend="pyarrow"
+    )
+
+@st.cache_data
+def load_herd_config() -> dict:
+    """Load herd sections and varieties from herd.toml."""
+    return load_toml("herd.toml")
+
+@st.cache_data
+def load_feed_meta() -> dict:
+    """Load feed items from feed.toml, keyed by cft_name."""
+    return {f["cft_name"]: f for f in load_toml("feed.toml")["feed"]}
+
+@st.cache_data
+def load_input_schema() -> dict:
+    """Build the metric -> survey cell/type/default mapping from the schema CSV."""
+    input_schema = pd.read_csv(os.path.join("schema", "input_schema_mapping.csv"))
+    columns = ["metric", "survey_mapping", "types", "default_value"]
+    return {
+        metric: {
+            "cell": cell,
+            "type": cell_type,
+            "default": default
+        }
+        for metric, cell, cell_type, default in input_schema.reindex(columns=columns).itertuples(
+            index=False, name=None
+        )
+    }
+
+
+herd_config = load_herd_config()
+herd_sections = herd_config["herd_section"]
+herd_varieties = herd_config["herd_variety"]
 
 
 # ---- Drop files
@@ -60,24 +99,13 @@ survey_dump = st.file_uploader(
 )
 
 # initialise mapping schema api
-schema_path = os.path.join("schema", "input_schema_mapping.csv")
-input_schema = pd.read_csv(schema_path)
-
-# Build structured mapping
-schema_dict = {
-    row.metric: {
-        "cell": row.survey_mapping,
-        "type": row.types,
-        "default": row.default_value if "default_value" in row else None
-    }
-    for _, row in input_schema.iterrows()
-}
+schema_dict = load_input_schema()
 
 # Extract columns
 input_columns = list(schema_dict.keys())
 
-# Init empty df to hold ingested data
-survey_loader = pd.DataFrame()
+# Existing records, projected to the columns an upload can produce
+df = load_existing_inputs(input_columns + ["survey_id"])
 
 feed_conversion_mapping = {
     "fwi_select": "C61",
@@ -88,22 +116,64 @@ feed_conversion_mapping = {
     "feed_period_day_custom": "D67"
 }
 
-# feed lookup dict
-feed_items = load_toml("feed.toml")["feed"]
-feed_meta = {
-    f["cft_name"]: f
-    for f in feed_items
+# Cast functions per schema type
+CASTERS = {
+    "int": int,
+    "float": lambda v: round(float(v), 6),
+    "string": lambda v: str(v).strip(),
 }
 
+# Schema resolved once into (metric, cell, cast, default) tuples for the parse loop
+survey_metrics = [
+    (metric, info["cell"], CASTERS.get(info["type"]), info["default"])
+    for metric, info in schema_dict.items()
+]
+
+# Every cell the parser reads, keyed by (row, col), so each workbook can be
+# streamed once instead of looked up cell by cell
+survey_cells = {
+    coordinate_to_tuple(cell): cell
+    for cell in [
+        *(info["cell"] for info in schema_dict.values()),
+        *feed_conversion_mapping.values(),
+    ]
+}
+survey_rows_needed = [row for row, _ in survey_cells]
+survey_cols_needed = [col for _, col in survey_cells]
+survey_bounds = {
+    "min_row": min(survey_rows_needed),
+    "max_row": max(survey_rows_needed),
+    "min_col": min(survey_cols_needed),
+    "max_col": max(survey_cols_needed),
+}
+
+# feed lookup dict
+feed_meta = load_feed_meta()
+
 # Cleaner function for invisible values in cells
 def cell_has_value(cell):
     if cell is None:
         return False
-    if pd.isna(cell):
-        return False
     if isinstance(cell, str):
         return cell.strip() != ""
-    return True
+    if isinstance(cell, float):
+        return cell == cell  # NaN is the only float not equal to itself
+    return cell is not pd.NA and cell is not pd.NaT
+
+# Raised for problems that make the whole survey unusable (bad feed
+# config, missing herd counts); parse_one_survey skips the file on it
+class SurveyAbort(Exception):
+    pass
+
+# Split a feed metric into its feed and herd section names (same few
+# columns for every survey, so resolve each one once)
+@lru_cache(maxsize=None)
+def parse_feed_metric(metric):
+    try:
+        _, feed_name, hs_name, _ = metric.split(".", 3)
+    except ValueError:
+        raise SurveyAbort(f"Invalid feed metric format: {metric}")
+    return feed_name, hs_name
 
 # feed normalisation function
 def normalize_feed_value(
@@ -125,16 +195,11 @@ def normalize_feed_value(
     """
 
     # ---- parse metric ----
-    try:
-        _, feed_name, hs_name, _ = metric.split(".", 3)
-    except ValueError:
-        st.error(f"Invalid feed metric format: {metric}")
-        st.stop()
+    feed_name, hs_name = parse_feed_metric(metric)
 
     feed_info = feed_meta.get(feed_name)
     if feed_info is None:
-        st.error(f"Unknown feed type in column name: {feed_name}")
-        st.stop()
+        raise SurveyAbort(f"Unknown feed type in column name: {feed_name}")
 
 
     # ---- 1. FWI → DMI ----
@@ -145,8 +210,7 @@ def normalize_feed_value(
             st.write(f"FWI→DMI factor for {feed_name}:", conversion_factor)
 
         if conversion_factor is None:
-            st.error(f"Missing FWI→DMI conversion factor for feed: {feed_name}")
-            st.stop()
+            raise SurveyAbort(f"Missing FWI→DMI conversion factor for feed: {feed_name}")
 
         value = value * conversion_factor
 
@@ -162,11 +226,10 @@ def normalize_feed_value(
             st.write(f"Herd count for {hs_name}:", herd_count)
 
         if herd_count is None or herd_count <= 0:
-            st.error(
+            raise SurveyAbort(
                 f"Herd count missing or invalid for herd type '{hs_name}' "
                 f"(expected column '{herd_count_key}')"
             )
-            st.stop()
 
         value = value / herd_count
 
@@ -185,7 +248,23 @@ def normalize_feed_value(
 
     return round(value, 6) if value is not None else None
 
+# Single pass over the bounding box of needed cells, keeping only those cells
+def read_survey_cells(ws):
+    values = {}
+    rows = ws.iter_rows(**survey_bounds, values_only=True)
+    for row_idx, row in enumerate(rows, start=survey_bounds["min_row"]):
+        for col_idx, value in enumerate(row, start=survey_bounds["min_col"]):
+            cell = survey_cells.get((row_idx, col_idx))
+            if cell is not None:
+                values[cell] = value
+                if len(values) == len(survey_cells):
+                    return values
+    return values
+
 # text slugify function for farm names
+SLUG_SEPARATORS = re.compile(r"[^a-z0-9]+")
+
+@lru_cache(maxsize=1024)
 def slugify(text: str) -> str:
     # Normalize accented characters → ASCII
     text = unicodedata.normalize("NFKD", text)
@@ -195,7 +274,7 @@ def slugify(text: str) -> str:
     text = text.lower()
 
     # Replace non-alphanumeric with hyphens
-    text = re.sub(r"[^a-z0-9]+", "-", text)
+    text = SLUG_SEPARATORS.sub("-", text)
 
     # Trim hyphens from start/end
     text = text.strip("-")
@@ -203,18 +282,25 @@ def slugify(text: str) -> str:
     return text
 
 
-# Loop and ingest each survey
-for survey in survey_dump:
+# Parse a single survey workbook into one row of metrics.
+# Runs in a worker thread, so it must not call Streamlit: problems are
+# collected as messages and rendered by the caller.
+def parse_one_survey(survey):
+    errors = []
 
-    wb = load_workbook(survey, data_only=True)
-    ws = wb.active
+    wb = load_workbook(survey, data_only=True, read_only=True, keep_links=False)
+    try:
+        cells = read_survey_cells(wb.active)
+    finally:
+        # read-only workbooks keep the archive open until closed
+        wb.close()
 
     row_data = {}
     skip_survey = False
 
     # helper
     def fail(msg):
-        st.error(f"❌ {survey.name} skipped — {msg}")
+        errors.append(f"❌ {survey.name} skipped — {msg}")
         return True
 
     # =====================================================
@@ -222,8 +308,8 @@ for survey in survey_dump:
     # =====================================================
 
     # --- DMI vs FWI ---
-    dmi_selected = cell_has_value(ws[feed_conversion_mapping["dmi_select"]].value)
-    fwi_selected = cell_has_value(ws[feed_conversion_mapping["fwi_select"]].value)
+    dmi_selected = cell_has_value(cells.get(feed_conversion_mapping["dmi_select"]))
+    fwi_selected = cell_has_value(cells.get(feed_conversion_mapping["fwi_select"]))
 
     if dmi_selected and fwi_selected:
         skip_survey = fail("Both DMI and FWI selected")
@@ -233,8 +319,8 @@ for survey in survey_dump:
         dmi_conversion = fwi_selected
 
     # --- Per animal vs herd ---
-    animal_selected = cell_has_value(ws[feed_conversion_mapping["feed_per_animal"]].value)
-    herd_selected = cell_has_value(ws[feed_conversion_mapping["feed_per_herd"]].value)
+    animal_selected = cell_has_value(cells.get(feed_conversion_mapping["feed_per_animal"]))
+    herd_selected = cell_has_value(cells.get(feed_conversion_mapping["feed_per_herd"]))
 
     if animal_selected and herd_selected:
         skip_survey = fail("Both per-animal and per-herd feed selected")
@@ -244,8 +330,8 @@ for survey in survey_dump:
         herd_feed_indicator = herd_selected
 
     # --- Feeding period ---
-    day_selected = cell_has_value(ws[feed_conversion_mapping["feed_period_day_single"]].value)
-    custom_day_selected = cell_has_value(ws[feed_conversion_mapping["feed_period_day_custom"]].value)
+    day_selected = cell_has_value(cells.get(feed_conversion_mapping["feed_period_day_single"]))
+    custom_day_selected = cell_has_value(cells.get(feed_conversion_mapping["feed_period_day_custom"]))
 
     if day_selected and custom_day_selected:
         skip_survey = fail("Both single-day and multi-day feeding selected")
@@ -254,43 +340,39 @@ for survey in survey_dump:
     elif day_selected:
         multiday_feed_indicator = 1
     else:
-        multiday_feed_indicator = ws[feed_conversion_mapping["feed_period_day_custom"]].value
+        multiday_feed_indicator = cells.get(feed_conversion_mapping["feed_period_day_custom"])
 
     if skip_survey:
-        continue
+        return None, errors
 
 
     # ---- Hard Checkpoint: farm_id must exist ----
     farm_id_cell = schema_dict["farm_id"]["cell"]
-    raw_farm_id = ws[farm_id_cell].value
+    raw_farm_id = cells.get(farm_id_cell)
     if not cell_has_value(raw_farm_id):
-        st.error(f"❌ {survey.name} skipped — missing Farm Name ({farm_id_cell})")
-        continue
+        errors.append(f"❌ {survey.name} skipped — missing Farm Name ({farm_id_cell})")
+        return None, errors
 
     # ---- Hard Checkpoint: milk_year must exist ----
     milk_year_cell = schema_dict["milk_year"]["cell"]
-    raw_milk_year = ws[milk_year_cell].value
+    raw_milk_year = cells.get(milk_year_cell)
     if not cell_has_value(raw_milk_year):
-        st.error(f"❌ {survey.name} skipped — missing milk_year ({milk_year_cell})")
-        continue
+        errors.append(f"❌ {survey.name} skipped — missing milk_year ({milk_year_cell})")
+        return None, errors
 
 
     # =====================================================
     # METRIC EXTRACTION LOOP
     # =====================================================
-    for metric, info in schema_dict.items():
+    for metric, cell, cast, default in survey_metrics:
         try:
-            value = ws[info["cell"]].value
+            value = cells.get(cell)
 
-            if not cell_has_value(value) and cell_has_value(info["default"]):
-                value = info["default"]
+            if not cell_has_value(value) and cell_has_value(default):
+                value = default
 
-            if info["type"] == "int":
-                value = int(value) if cell_has_value(value) else None
-            elif info["type"] == "float":
-                value = round(float(value), 6) if cell_has_value(value) else None
-            elif info["type"] == "string":
-                value = str(value).strip() if cell_has_value(value) else None
+            if cast is not None:
+                value = cast(value) if cell_has_value(value) else None
 
             # shorthand breed
             if metric.endswith("main_breed_variety") and cell_has_value(value):
@@ -335,23 +417,85 @@ for survey in survey_dump:
                 }
                 value = bedding_type_mapping.get(slugify(value), value)
 
-        except Exception as e:
-            st.error(f"{survey.name} failed on metric {metric}: {e}")
+        except SurveyAbort as e:
+            errors.append(f"❌ {survey.name} skipped — {e}")
+            return None, errors
+
+        except (TypeError, ValueError) as e:
+            errors.append(f"{survey.name} failed on metric {metric}: {e}")
             value = None
 
         row_data[metric] = value
 
 
-    farm_id = row_data.get("farm_id")
-    milk_year = row_data.get("milk_year")
+    # ---- Hard Checkpoint: milk_year must be a usable year ----
+    if row_data.get("milk_year") is None:
+        errors.append(f"❌ {survey.name} skipped — milk_year ({milk_year_cell}) is not a year")
+        return None, errors
 
-    row_data["survey_id"] = f"{str(farm_id).strip()}_{int(milk_year)}"
+    return row_data, errors
+
+
+# survey_id (business identifier) = "<farm_id>_<milk_year>", built for a whole frame
+def derive_survey_ids(frame):
+    return (
+        frame["farm_id"].astype("string").str.strip()
+        + "_"
+        + frame["milk_year"].astype("Int64").astype("string")
+    ).astype(object)
 
-    survey_loader = pd.concat(
-        [survey_loader, pd.DataFrame([row_data])],
-        ignore_index=True
-    )
 
+# Identify an uploaded file by name, size and content hash
+def survey_cache_key(survey):
+    data = survey.getvalue()
+    return (survey.name, len(data), hashlib.blake2b(data, digest_size=16).hexdigest())
+
+
+# Parse new surveys in parallel; files already parsed this session are reused
+parsed_surveys = st.session_state.setdefault("parsed_surveys", {})
+survey_keys = [survey_cache_key(survey) for survey in survey_dump]
+
+# The same workbook uploaded again under another name is only parsed once
+first_upload_of = {}
+repeated_uploads = {}
+for i, (key, survey) in enumerate(zip(survey_keys, survey_dump)):
+    content = key[1:]
+    if content in first_upload_of:
+        repeated_uploads[i] = first_upload_of[content]
+    else:
+        first_upload_of[content] = survey.name
+
+pending = [
+    (key, survey)
+    for i, (key, survey) in enumerate(zip(survey_keys, survey_dump))
+    if i not in repeated_uploads and key not in parsed_surveys
+]
+
+if pending:
+    with ThreadPoolExecutor(max_workers=min(8, len(pending))) as executor:
+        results = executor.map(parse_one_survey, [survey for _, survey in pending])
+        for (key, _), result in zip(pending, results):
+            parsed_surveys[key] = result
+
+# Drop results for files no longer in the uploader
+st.session_state.parsed_surveys = {
+    key: parsed_surveys[key] for key in survey_keys if key in parsed_surveys
+}
+
+# Report problems in upload order
+survey_rows = []
+for i, key in enumerate(survey_keys):
+    if i in repeated_uploads:
+        st.info(f"Skipped {survey_dump[i].name} — same file as {repeated_uploads[i]}")
+        continue
+    row_data, errors = parsed_surveys[key]
+    for msg in errors:
+        st.error(msg)
+    if row_data is not None:
+        survey_rows.append(row_data)
+
+survey_loader = pd.DataFrame(survey_rows, columns=input_columns + ["survey_id"])
+survey_loader["survey_id"] = derive_survey_ids(survey_loader)
 
 
 def validation_rules():
@@ -376,18 +520,28 @@ def display_error_correction_ui(error_report, df):
     )
 
     # Reset state if the underlying df changes (simple + reliable)
-    df_sig = tuple(df["survey_id"].astype(str).tolist())
+    survey_id_hashes = pd.util.hash_pandas_object(df["survey_id"], index=False).to_numpy()
+    df_sig = hashlib.blake2b(survey_id_hashes.tobytes(), digest_size=8).digest()
     if st.session_state.get("dq_df_sig") != df_sig:
         st.session_state.dq_df_sig = df_sig
         st.session_state.current_error_idx = 0
         st.session_state.corrected_df = df.copy()
 
-    current_idx = st.session_state.current_error_idx
-
-    if current_idx >= len(error_report):
+    if st.session_state.current_error_idx >= len(error_report):
         st.success("✅ All errors reviewed!")
         return st.session_state.corrected_df, True
 
+    render_current_error(error_report, df)
+
+    return st.session_state.corrected_df, False
+
+
+# Only this part reruns while the user steps between errors; the page is
+# rerun once the last error is applied so the submit form shows
+@st.fragment
+def render_current_error(error_report, df):
+    current_idx = st.session_state.current_error_idx
+
     current_error = error_report[current_idx]
     survey_id = current_error.get("survey_id")
 
@@ -411,77 +565,82 @@ def display_error_correction_ui(error_report, df):
     identifier = current_error["row_data"].get("farm_name", survey_id)
     st.error(f"### ❌ {identifier} has {len(current_error['errors'])} error(s)")
 
-    corrections = {}
-
-    for col_name, error_info in current_error["errors"].items():
-        with st.container():
-            st.markdown(f"**Column: `{col_name}`**")
-
-            col1, col2 = st.columns([1, 2])
-
-            with col1:
-                st.write("**Current value:**")
-                st.code(str(error_info["current_value"]))
-                st.write("**Issues:**")
-                for err in error_info["errors"]:
-                    st.write(f"- {err}")
-
-            with col2:
-                rules = error_info["rules"]
-
-                if rules.get("type") == "categorical":
-                    corrected = st.selectbox(
-                        f"Fix {col_name}",
-                        options=rules["allowed_values"],
-                        key=f"fix_{survey_id}_{col_name}",
-                        label_visibility="collapsed",
-                    )
-                elif rules.get("type") in ["numeric", "integer"]:
-                    initial = float(error_info["current_value"]) if pd.notna(error_info["current_value"]) else 0.0
-                    corrected = st.number_input(
-                        f"Fix {col_name}",
-                        value=initial,
-                        min_value=rules.get("min"),
-                        max_value=rules.get("max"),
-                        key=f"fix_{survey_id}_{col_name}",
-                        label_visibility="collapsed",
-                    )
-                else:
-                    corrected = st.text_input(
-                        f"Fix {col_name}",
-                        value=str(error_info["current_value"]) if pd.notna(error_info["current_value"]) else "",
-                        key=f"fix_{survey_id}_{col_name}",
-                        label_visibility="collapsed",
-                    )
-
-                corrections[col_name] = corrected
-
-            st.divider()
-
-    col1, col2, col3 = st.columns([1, 1, 1])
-
-    with col1:
-        if current_idx > 0 and st.button("⬅️ Previous", use_container_width=True):
-            st.session_state.current_error_idx -= 1
-            st.rerun()
-
-    with col2:
-        if st.button("✅ Apply & Continue", use_container_width=True, type="primary"):
-            for col_name, value in corrections.items():
-                st.session_state.corrected_df.at[row_idx, col_name] = value
-            st.session_state.current_error_idx += 1
-            st.rerun()
-
-    with col3:
-        if st.button("🔄 Reset All", use_container_width=True):
-            st.session_state.current_error_idx = 0
-            st.session_state.corrected_df = df.copy()
-            st.rerun()
-
-    return st.session_state.corrected_df, False
+    # Edits are held by the form, so typing does not rerun anything
+    with st.form(f"fix_form_{survey_id}", border=False):
+        corrections = {}
+
+        for col_name, error_info in current_error["errors"].items():
+            with st.container():
+                st.markdown(f"**Column: `{col_name}`**")
+
+                col1, col2 = st.columns([1, 2])
+
+                with col1:
+                    st.write("**Current value:**")
+                    st.code(str(error_info["current_value"]))
+                    st.write("**Issues:**")
+                    for err in error_info["errors"]:
+                        st.write(f"- {err}")
+
+                with col2:
+                    rules = error_info["rules"]
+
+                    if rules.get("type") == "categorical":
+                        corrected = st.selectbox(
+                            f"Fix {col_name}",
+                            options=rules["allowed_values"],
+                            key=f"fix_{survey_id}_{col_name}",
+                            label_visibility="collapsed",
+                        )
+                    elif rules.get("type") in ["numeric", "integer"]:
+                        initial = float(error_info["current_value"]) if pd.notna(error_info["current_value"]) else 0.0
+                        corrected = st.number_input(
+                            f"Fix {col_name}",
+                            value=initial,
+                            min_value=rules.get("min"),
+                            max_value=rules.get("max"),
+                            key=f"fix_{survey_id}_{col_name}",
+                            label_visibility="collapsed",
+                        )
+                    else:
+                        corrected = st.text_input(
+                            f"Fix {col_name}",
+                            value=str(error_info["current_value"]) if pd.notna(error_info["current_value"]) else "",
+                            key=f"fix_{survey_id}_{col_name}",
+                            label_visibility="collapsed",
+                        )
+
+                    corrections[col_name] = corrected
+
+                st.divider()
+
+        col1, col2, col3 = st.columns([1, 1, 1])
+
+        with col1:
+            if current_idx > 0 and st.form_submit_button("⬅️ Previous", use_container_width=True):
+                st.session_state.current_error_idx -= 1
+                st.rerun(scope="fragment")
+
+        with col2:
+            if st.form_submit_button("✅ Apply & Continue", use_container_width=True, type="primary"):
+                for col_name, value in corrections.items():
+                    st.session_state.corrected_df.at[row_idx, col_name] = value
+                st.session_state.current_error_idx += 1
+                if st.session_state.current_error_idx >= len(error_report):
+                    st.rerun()
+                st.rerun(scope="fragment")
+
+        with col3:
+            if st.form_submit_button("🔄 Reset All", use_container_width=True):
+                st.session_state.current_error_idx = 0
+                st.session_state.corrected_df = df.copy()
+                st.rerun(scope="fragment")
 
 
 # ----- get into columns
+# Per-category emission fields expanded into <category>_<field> columns
+EMISSION_FIELDS = ["CO2", "N2O", "CH4", "total_CO2e", "total_CO2e_per_fpcm"]
+
 def flatten_cft_response(response: list) -> pd.DataFrame:
     """
     Flattens a CFT API response into a single wide table.
@@ -489,61 +648,63 @@ def flatten_cft_response(response: list) -> pd.DataFrame:
     Splits farm_identifier into farm_name and farm_year.
     """
 
-    rows = []
-
-    for record in response:
-
-        farm_identifier = record["farm"]["farm_identifier"]
+    records = pd.json_normalize(response)
+    disagg = pd.json_normalize(records["summary.disaggregation_totals"].str[0].tolist())
 
+    farm_identifier = records["farm.farm_identifier"]
+    identifier_parts = farm_identifier.str.rsplit("_", n=1)
+    milk_year = identifier_parts.str[1]
 
-        if "_" in farm_identifier:
-            farm_id, milk_year = farm_identifier.rsplit("_", 1)
-        else:
-            farm_id = farm_identifier
-            milk_year = None
-            st.warning("Farm identifier missing year suffix. Contact administrator.")
+    if milk_year.isna().any():
+        st.warning("Farm identifier missing year suffix. Contact administrator.")
 
-        summary = record["summary"]
-        disagg = summary["disaggregation_totals"][0]
+    df_wide = pd.DataFrame({
+        "survey_id": farm_identifier,
+        "farm_id": identifier_parts.str[0],
+        "milk_year": pd.to_numeric(milk_year, errors="coerce"),
 
-        row = {
-            "survey_id": farm_identifier,
-            "farm_id": farm_id,
-            "milk_year": pd.to_numeric(milk_year, errors="coerce"),
+        # Overall summary
+        "emissions_total": records["summary.emissions_total"].str[0].astype(float),
+        "emissions_total_unit": records["summary.emissions_total"].str[1],
+        "emissions_per_fpcm": records["summary.emissions_per_fpcm"].str[0].astype(float),
+        "emissions_per_fpcm_unit": records["summary.emissions_per_fpcm"].str[1],
 
-            # Overall summary
-            "emissions_total": float(summary["emissions_total"][0]),
-            "emissions_total_unit": summary["emissions_total"][1],
-            "emissions_per_fpcm": float(summary["emissions_per_fpcm"][0]),
-            "emissions_per_fpcm_unit": summary["emissions_per_fpcm"][1],
+        # Disaggregation totals
+        "CO2_tonnes": disagg["CO2.metric_tonnes_CO2"].str[0].astype(float),
+        "CO2e_from_CO2_tonnes": disagg["CO2.metric_tonnes_CO2e"].str[0].astype(float),
 
-            # Disaggregation totals
-            "CO2_tonnes": float(disagg["CO2"]["metric_tonnes_CO2"][0]),
-            "CO2e_from_CO2_tonnes": float(disagg["CO2"]["metric_tonnes_CO2e"][0]),
+        "N2O_tonnes": disagg["N2O.metric_tonnes_N2O"].str[0].astype(float),
+        "CO2e_from_N2O_tonnes": disagg["N2O.metric_tonnes_CO2e"].str[0].astype(float),
 
-            "N2O_tonnes": float(disagg["N2O"]["metric_tonnes_N2O"][0]),
-            "CO2e_from_N2O_tonnes": float(disagg["N2O"]["metric_tonnes_CO2e"][0]),
+        "CH4_tonnes": disagg["CH4.metric_tonnes_CH4"].str[0].astype(float),
+        "CO2e_from_CH4_tonnes": disagg["CH4.metric_tonnes_CO2e"].str[0].astype(float),
 
-            "CH4_tonnes": float(disagg["CH4"]["metric_tonnes_CH4"][0]),
-            "CO2e_from_CH4_tonnes": float(disagg["CH4"]["metric_tonnes_CO2e"][0]),
-
-            # Metadata
-            "cft_version": record["information"]["cft_version"]
-        }
+        # Metadata
+        "cft_version": records["information.cft_version"],
+    })
 
-        # Flatten category-level emissions into wide columns
-        for item in record["total_emissions"]:
-            name = item["name"]
-
-            row[f"{name}_CO2"] = float(item["CO2"])
-            row[f"{name}_N2O"] = float(item["N2O"])
-            row[f"{name}_CH4"] = float(item["CH4"])
-            row[f"{name}_total_CO2e"] = float(item["total_CO2e"])
-            row[f"{name}_total_CO2e_per_fpcm"] = float(item["total_CO2e_per_fpcm"])
-
-        rows.append(row)
+    # Flatten category-level emissions into wide columns
+    emissions = pd.json_normalize(
+        response,
+        record_path="total_emissions",
+        meta=[["farm", "farm_identifier"]],
+    )
+    by_category = emissions.pivot(
+        index="farm.farm_identifier",
+        columns="name",
+        values=EMISSION_FIELDS,
+    ).astype(float)
+
+    # Keep each category's columns together, in response order
+    ordered = [
+        (field, name)
+        for name in emissions["name"].unique()
+        for field in EMISSION_FIELDS
+    ]
+    by_category = by_category[ordered]
+    by_category.columns = [f"{name}_{field}" for field, name in ordered]
 
-    df_wide = pd.DataFrame(rows)
+    df_wide = df_wide.join(by_category, on="survey_id")
 
     return df_wide
 
@@ -593,20 +754,16 @@ if not survey_loader.empty:
         # Display correction UI
         corrected_df, all_valid = display_error_correction_ui(error_report, resolved_df)
 
-        # Ensure numeric columns are never null
-        numeric_cols = corrected_df.select_dtypes(include=["number"]).columns.tolist()
-        corrected_df[numeric_cols] = corrected_df[numeric_cols].fillna(0)
+        # Ensure numeric columns are never null, at the precision we store
+        numeric = corrected_df.select_dtypes(include="number")
+        corrected_df[numeric.columns] = numeric.fillna(0).round(6)
         
         # Only show submit button when all valid
         if all_valid:
 
             # ---- derive survey_id (business identifier) ----
             if "survey_id" not in corrected_df.columns:
-                corrected_df["survey_id"] = (
-                    corrected_df["farm_id"].astype(str).str.strip()
-                    + "_"
-                    + corrected_df["milk_year"].astype(int).astype(str)
-                )
+                corrected_df["survey_id"] = derive_survey_ids(corrected_df)
 
             # Optional sanity check (recommended)
             if corrected_df["survey_id"].isna().any():
@@ -627,13 +784,11 @@ if not survey_loader.empty:
                     # -------------------------------------------------
                     # Get overwrites from duplicate decisions
                     # -------------------------------------------------
-                    overwrite_ids = []
-                    if 'duplicate_decisions' in st.session_state:
-                        overwrite_ids = [
-                            farm_id for farm_id, decision 
-                            in st.session_state.duplicate_decisions.items() 
-                            if decision == "overwrite"
-                        ]
+                    overwrite_ids = {
+                        farm_id for farm_id, decision
+                        in st.session_state.get("duplicate_decisions", {}).items()
+                        if decision == "overwrite"
+                    }
 
                     st.info(f"Uploading {len(corrected_df)} record(s)... ({len(overwrite_ids)} overwrites)")
 
@@ -642,31 +797,19 @@ if not survey_loader.empty:
                     # -------------------------------------------------
                     # Build payloads
                     # -------------------------------------------------
+                    # New rows and overwrites share upsert semantics on
+                    # survey_id, so they go out together in bulk chunks.
                     records = corrected_df.to_dict(orient="records")
 
-                    # If you want true upsert semantics for *all* rows:
-                    # upsert_dairy_inputs(records)
-
-                    # If you want overwrite to mean "hard replace":
-                    new_rows = []
-                    overwrite_rows = []
-
-                    for r in records:
-                        farm_id = r.get("farm_id")
-                        if farm_id in overwrite_ids:
-                            overwrite_rows.append(r)
-                        else:
-                            new_rows.append(r)
-
                     try:
-                        numeric_cols = corrected_df.select_dtypes(include="number").columns
-                        corrected_df[numeric_cols] = corrected_df[numeric_cols].round(6)
-
                         with st.status("Submitting to CFT API...", expanded=True) as status:
                             # -------------------------------------------------
                             # Run CFT API first
                             # -------------------------------------------------
-                            api_results = submit_new_surveys(corrected_df)
+                            api_results = submit_new_surveys(
+                                corrected_df,
+                                on_progress=lambda done, total: progress_bar.progress(done / total),
+                            )
                             if not api_results:
                                 st.error("CFT API returned no results.")
                                 st.stop()
@@ -674,21 +817,19 @@ if not survey_loader.empty:
                             df_wide = flatten_cft_response(api_results)
 
                             # -------------------------------------------------
-                            # API succeeded — now upsert inputs
+                            # API succeeded — now write inputs and outputs
+                            # (independent tables, so both go out together)
                             # -------------------------------------------------
-                            status.update(label="Saving inputs to database...")
-
-                            if new_rows:
-                                upsert_dairy_inputs(new_rows)
+                            status.update(label="Saving inputs and outputs to database...")
 
-                            if overwrite_rows:
-                                upsert_dairy_inputs(overwrite_rows)
+                            with ThreadPoolExecutor(max_workers=2) as executor:
+                                inputs_saved = executor.submit(upsert_dairy_inputs_bulk, records)
+                                outputs_saved = executor.submit(upsert_outputs_from_df, df_wide)
+                                inputs_saved.result()
+                                outputs_saved.result()
 
-                            # -------------------------------------------------
-                            # Write outputs to Supabase
-                            # -------------------------------------------------
-                            status.update(label="Saving outputs to database...")
-                            upsert_outputs_from_df(df_wide)
+                            # Next rerun should see the rows we just wrote
+                            load_existing_inputs.clear()
 
                             status.update(label=f"🎉 All {len(records)} record(s) uploaded successfully!", state="complete", expanded=False)
 
@@ -1,8 +1,9 @@
 from config.config_loader import load_toml
 import streamlit as st
-import urllib3
 import requests
-import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # ---- Load Global Configurations ---- #
 
@@ -11,6 +12,23 @@ HERD_SECTIONS = load_toml("herd.toml")["herd_section"]
 FERTILIZERS = load_toml("fertilizer.toml")["fertilizer"]
 HERD_VARIETIES = load_toml("herd.toml")["herd_variety"]
 
+# Row columns read for every payload, resolved once from the configs
+FEED_COMPONENT_COLUMNS = [
+    (feed, hs, f"feed.{feed['cft_name']}.{hs['cft_name']}.kgDMI_head_day")
+    for feed in FEED_ITEMS
+    for hs in HERD_SECTIONS
+]
+OFF_FARM_FEED_COLUMNS = [
+    (column, f"{hs['cft_name']}.herd_count", feed.get("fwi_to_dmi", 1))
+    for feed, hs, column in FEED_COMPONENT_COLUMNS
+    if feed.get("production_location") != "on-farm"
+]
+OFF_FARM_FERTILIZER_COLUMNS = [
+    f"fertilizers.{fert['key']}.t_per_ha"
+    for fert in FERTILIZERS
+    if fert.get("production_location") != "on-farm"
+]
+
 ID_MAPPINGS = {
     "grazing_quality": {
         "HIGH": 1,
@@ -159,18 +177,17 @@ def build_feed_components_input(row):
     """Build feed components section input"""
     feed_components_input = []
     
-    for feed in FEED_ITEMS:
-        for hs in HERD_SECTIONS:
-            feed_components_input.append({
-                "item": feed["cft_id"],
-                "region": feed["region_name"],
-                "herd_section": hs["cft_name"],
-                "dry_matter": {
-                    "value": row[f"feed.{feed['cft_name']}.{hs['cft_name']}.kgDMI_head_day"],
-                    "unit": UNITS["feed_weight"]
-                },
-                "certified": False
-            })
+    for feed, hs, column in FEED_COMPONENT_COLUMNS:
+        feed_components_input.append({
+            "item": feed["cft_id"],
+            "region": feed["region_name"],
+            "herd_section": hs["cft_name"],
+            "dry_matter": {
+                "value": row[column],
+                "unit": UNITS["feed_weight"]
+            },
+            "certified": False
+        })
     
     return feed_components_input
 
@@ -178,56 +195,44 @@ def build_feed_additives_input(row):
     """Build feed additives section input"""
     return []  # Currently not implemented
 
+# Manure storage systems, as named by the CFT API
+MANURE_PIT = "Pit storage below animal confinements (6 months)"
+MANURE_SOLID = "Solid storage"
+MANURE_DEEP_BEDDING = "Deep bedding - no mixing (< 1 month)"
+MANURE_LIQUID_COVER = "Liquid slurry with cover"
+MANURE_LIQUID_NO_COVER = "Liquid slurry without natural crust cover"
+MANURE_ANAEROBIC_DIGESTER = "Anaerobic Digester, Low leakage, High quality industrial technology, open storage"
+
+# Survey manure_type code -> [(storage type, allocation %)]
+MANURE_ALLOCATIONS = {
+    1: [(MANURE_PIT, 50), (MANURE_SOLID, 50)],  # Pit and Storage
+    2: [(MANURE_DEEP_BEDDING, 100)],  # Deep bedding
+    3: [(MANURE_PIT, 100)],  # Pit Storage
+    4: [(MANURE_LIQUID_COVER, 100)],  # Liquid slurry with cover
+    5: [(MANURE_LIQUID_NO_COVER, 100)],  # Liquid slurry without natural crust cover
+    6: [(MANURE_ANAEROBIC_DIGESTER, 100)],  # Anaerobic Digester
+    7: [(MANURE_PIT, 25), (MANURE_SOLID, 25), (MANURE_DEEP_BEDDING, 50)],  # Custom
+    8: [(MANURE_PIT, 50), (MANURE_DEEP_BEDDING, 50)],  # No manure management (e.g. pasture only)
+}
+MANURE_DEFAULT_ALLOCATION = [(MANURE_SOLID, 25), (MANURE_PIT, 75)]
+
+# (herd section, manure_type column) for every herd section
+MANURE_COLUMNS = [
+    (hs["cft_name"], f"manure_type.{hs['cft_name']}") for hs in HERD_SECTIONS
+]
+
 def build_manure_input(row):
     """Build manure section input"""
     manure_inputs = []
-    herd_sections = ["calf_dairy", "heifer", "cow_milk", "cow_dry"]
-    
-    for herd in herd_sections:
-        manure_type = int(row[f"manure_type.{herd}"])
-
-        pit = "Pit storage below animal confinements (6 months)"
-        solid = "Solid storage"
-        deep = "Deep bedding - no mixing (< 1 month)"
-        liquid_cover = "Liquid slurry with cover"
-        liquid_no_cover = "Liquid slurry without natural crust cover"
-        anaerobic_digester = "Anaerobic Digester, Low leakage, High quality industrial technology, open storage"
 
-        
-        if manure_type == 1: # Pit and Storage 
-            manure_inputs.extend([
-                {"herd_section": herd, "type": pit, "allocation": 50},  # Pit Storage
-                {"herd_section": herd, "type": solid, "allocation": 50},  # Solid Storage
-            ])
-        elif manure_type == 2: # Deep bedding
-            manure_inputs.append({"herd_section": herd, "type": deep, "allocation": 100 })
-        elif manure_type == 3: # Pit Storage
-            manure_inputs.append({"herd_section": herd, "type": pit, "allocation": 100 })
-        elif manure_type == 4: # Liquid slurry with cover
-            manure_inputs.append({"herd_section": herd, "type": liquid_cover, "allocation": 100 })
-        elif manure_type == 5: # Liquid slurry without natural crust cover
-            manure_inputs.append({"herd_section": herd, "type": liquid_no_cover, "allocation": 100 })
-        elif manure_type == 6: # Anaerobic Digester, Low leakage, High quality industrial technology, open storage
-            manure_inputs.append({"herd_section": herd, "type": anaerobic_digester, "allocation": 100 })
-        elif manure_type == 7: # Custom
-            manure_inputs.extend([
-                {"herd_section": herd, "type": pit, "allocation": 25},  # Pit Storage
-                {"herd_section": herd, "type": solid, "allocation": 25},  # Solid Storage
-                {"herd_section": herd, "type": deep, "allocation": 50},  # Deep Bedding
-                ])
-        elif manure_type == 8: # No manure management (e.g. pasture only)
-            manure_inputs.extend([
-                {"herd_section": herd, "type": pit, "allocation": 50}, 
-                {"herd_section": herd, "type": deep, "allocation": 50}, 
-            ])
-        else:
-            manure_inputs.extend([
-                {"herd_section": herd, "type": solid, "allocation": 25}, 
-                {"herd_section": herd, "type": pit, "allocation": 75}, 
-            ])
-            
+    for herd, column in MANURE_COLUMNS:
+        manure_type = int(row[column])
+        allocations = MANURE_ALLOCATIONS.get(manure_type, MANURE_DEFAULT_ALLOCATION)
+        manure_inputs.extend(
+            {"herd_section": herd, "type": storage, "allocation": allocation}
+            for storage, allocation in allocations
+        )
 
-    
     return manure_inputs
 
 def build_bedding_input(row):
@@ -292,24 +297,18 @@ def build_direct_energy_input(row):
     ]  # Currently not implemented
 
 def build_transport_input(row):
-    off_farm_feed = [feed for feed in FEED_ITEMS if feed.get('production_location') != "on-farm"]
-    off_farm_fert = [fert for fert in FERTILIZERS if fert.get('production_location') != "on-farm"]
-
-    feed_fwi_lookup = {feed['cft_name']: feed['fwi_to_dmi'] for feed in FEED_ITEMS}
-
     total_off_farm_feed_fwi = sum([
-        (row.get(f"feed.{feed['cft_name']}.{hs['cft_name']}.kgDMI_head_day") or 0) *
+        (row.get(feed_column) or 0) *
         (
-            (row.get(f"{hs['cft_name']}.herd_count") or 0) 
+            (row.get(herd_count_column) or 0) 
         ) * 365
-        / feed_fwi_lookup.get(feed['cft_name'], 1)
-        for feed in off_farm_feed
-        for hs in HERD_SECTIONS
+        / fwi_to_dmi
+        for feed_column, herd_count_column, fwi_to_dmi in OFF_FARM_FEED_COLUMNS
     ]) / 1000
 
     total_off_farm_fertilizer = sum([
-        row.get(f"fertilizers.{fert['key']}.t_per_ha", 0) * row.get("general.grazing_area_ha", 0)
-        for fert in off_farm_fert
+        row.get(fert_column, 0) * row.get("general.grazing_area_ha", 0)
+        for fert_column in OFF_FARM_FERTILIZER_COLUMNS
     ])
 
     total_weight = total_off_farm_feed_fwi + total_off_farm_fertilizer
@@ -363,7 +362,36 @@ HEADERS = {
     "X-Api-Authorization": st.secrets["cft_api"]["api_key"]
 }
 
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+# Shared session so CFT API calls reuse pooled TLS connections
+SESSION = requests.Session()
+SESSION.headers.update(HEADERS)
+SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=16,
+        max_retries=Retry(total=3, backoff_factor=0.2),
+    ),
+)
+
+CFT_API_URL = st.secrets["cft_api"]["api_url"]
+
+# Upper bound on simultaneous requests to the CFT API
+MAX_CONCURRENT_REQUESTS = 8
+
+def post_cft_payload(payload, farm_id):
+    """
+    Sends one payload to the CFT API and returns (result, error_message).
+    Does not touch Streamlit, so it is safe to run in worker threads.
+    """
+    try:
+        response = SESSION.post(CFT_API_URL, json=payload, timeout=100)
+        response.raise_for_status()
+        return response.json(), None
+    except requests.exceptions.HTTPError as e:
+        return None, f"API error for farm_id {farm_id}: {response.text}"
+    except requests.exceptions.RequestException as e:
+        return None, f"Request failed for farm_id {farm_id}: {e}"
 
 def call_cft_api(row, debug=False):
     payload = process_single_row(row)
@@ -371,44 +399,42 @@ def call_cft_api(row, debug=False):
     if st.session_state.get("debug", False) or debug:
         st.write(payload)
     
-    try:
-        response = requests.post(
-            st.secrets["cft_api"]["api_url"],
-            json=payload,
-            headers=HEADERS,
-            verify=False,
-            timeout=100
-        )
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.HTTPError as e:
-        st.error(f"API error for farm_id {row.get('farm_id')}: {response.text}")
-        return None
-    except requests.exceptions.RequestException as e:
-        st.error(f"Request failed for farm_id {row.get('farm_id')}: {e}")
-        return None
+    result, error = post_cft_payload(payload, row.get("farm_id"))
+    if error:
+        st.error(error)
+    return result
     
 
-def submit_new_surveys(df):
-    results = []
-    for _, row in df.iterrows():
-        api_result = call_cft_api(row, debug=False)
-        results.append(api_result)
-    return results
+def submit_new_surveys(df, on_progress=None):
+    """
+    Submits every row to the CFT API concurrently and returns the results
+    in row order. on_progress(done, total) is called as requests finish.
+    """
+    rows = df.to_dict(orient="records")
+    if not rows:
+        return []
+
+    # Payloads are built (and debug-printed) on the script thread
+    payloads = [process_single_row(row) for row in rows]
+    if st.session_state.get("debug", False):
+        for payload in payloads:
+            st.write(payload)
+
+    results = [None] * len(rows)
+    workers = min(MAX_CONCURRENT_REQUESTS, len(rows))
 
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(post_cft_payload, payload, row.get("farm_id")): i
+            for i, (row, payload) in enumerate(zip(rows, payloads))
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            result, error = future.result()
+            if error:
+                st.error(error)
+            results[futures[future]] = result
+            if on_progress is not None:
+                on_progress(done, len(rows))
+
+    return results
 
-# ---- UTILITIES ---- #
-def flatten_json(obj, parent_key='', sep='.'):
-    """Recursively flattens nested dicts and lists into dot-separated keys."""
-    items = []
-    if isinstance(obj, dict):
-        for k, v in obj.items():
-            new_key = f"{parent_key}{sep}{k}" if parent_key else k
-            items.extend(flatten_json(v, new_key, sep=sep).items())
-    elif isinstance(obj, list):
-        for i, v in enumerate(obj):
-            new_key = f"{parent_key}{sep}{i}" if parent_key else str(i)
-            items.extend(flatten_json(v, new_key, sep=sep).items())
-    else:
-        items.append((parent_key, obj))
-    return dict(items)
\ No newline at end of file